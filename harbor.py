@@ -1,83 +1,169 @@
-import requests
+import httpx
 import sqlite3
-import json
+import logging
+import orjson
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from types import MappingProxyType
 import re
+import time
+import threading
+from queue import Queue, Empty
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of item IDs sent in a single items request
+ITEMS_BATCH_SIZE = 50
+
+# Transient gateway errors are retried with exponential backoff
+RETRY_STATUSES = {502, 503, 504}
+MAX_RETRIES = 3
+BACKOFF_FACTOR = 0.3
+
+# Invoices fetched in parallel, and the most invoices written per transaction
+FETCH_WORKERS = 4
+WRITE_BATCH_SIZE = 1000
+
+# Shared read-only stand-in for line items with no item details
+_EMPTY_DICT = MappingProxyType({})
+
+# Insert statements are kept as constants so sqlite3's statement cache reuses them
+_INSERT_INVOICE_SQL = '''
+INSERT OR REPLACE INTO harbor_invoices 
+(document_id, document_type, bill_to_id, bill_to_name, bill_to_address,
+ bill_to_city, bill_to_state, bill_to_zip, order_id, posted_date,
+ order_date, due_date, ship_to_name, ship_to_address, ship_to_city,
+ ship_to_state, ship_to_zip, payment_terms, payment_method,
+ transaction_type, allowances, charges, discounts, sales_tax,
+ subtotal, invoice_total, categories, items)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+_INSERT_CATEGORY_SQL = '''
+INSERT INTO harbor_categories 
+(invoice_id, category_name, category_id, item_count, total_cost)
+VALUES (?, ?, ?, ?, ?)
+'''
+
+_INSERT_LINE_ITEM_SQL = '''
+INSERT INTO harbor_invoice_items 
+(invoice_id, item_id, item_description, brand_name, category_id,
+ unit_price, net_price, quantity, uom, retail_upc, vendor_id, srp,
+ margin_pct, package_description, line_total, cost_per_unit, sold_by)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+def _json(response):
+    """Decode a JSON response body with orjson"""
+    return orjson.loads(response.content)
 
 class HarborAPI:
     def __init__(self):
         self.base_url = "https://api.harborwholesale.com/api"
         self.account_id = "700030"
-        self.session = requests.Session()
+        # HTTP/2 lets concurrent requests share one multiplexed TLS connection;
+        # the pool is sized for the parallel fetches and retries failed connects
+        transport = httpx.HTTPTransport(
+            http2=True,
+            retries=MAX_RETRIES,
+            limits=httpx.Limits(max_connections=16, max_keepalive_connections=16)
+        )
+        # httpx defaults to a 5s timeout and no redirects; allow for large
+        # item payloads and follow redirects like requests did
+        self.client = httpx.Client(
+            transport=transport,
+            timeout=httpx.Timeout(30.0, connect=5.0),
+            follow_redirects=True
+        )
        
     def authenticate(self, token):
         """Set up authentication for all requests with the provided token"""
-        self.session.headers.update({
+        self.client.headers.update({
             'Authorization': f'Bearer {token}',
             'Content-Type': 'application/json'
         })
 
+    def _request(self, method, url, **kwargs):
+        """Send a request, retrying transient 5xx responses with backoff"""
+        for attempt in range(MAX_RETRIES + 1):
+            response = self.client.request(method, url, **kwargs)
+            if response.status_code not in RETRY_STATUSES or attempt == MAX_RETRIES:
+                break
+            time.sleep(BACKOFF_FACTOR * (2 ** attempt))
+        response.raise_for_status()
+        return response
+
     def get_document_header(self, document_id):
         """Get invoice header details"""
         url = f"{self.base_url}/v2.0/OrderHistory/{self.account_id}/GetPostedDocumentHeader"
         params = {'documentId': document_id}
-        response = self.session.get(url, params=params)
-        response.raise_for_status()
-        return response.json()
+        response = self._request('GET', url, params=params)
+        return _json(response)
        
     def get_line_items(self, document_id):
         """Get line items for document"""
         url = f"{self.base_url}/v2.0/OrderHistory/{self.account_id}/GetPostedDocumentLines"
         params = {'documentId': document_id}
         data = {'documentId': document_id}
-        response = self.session.post(url, params=params, json=data)
-        response.raise_for_status()
+        response = self._request('POST', url, params=params, content=orjson.dumps(data))
+       
+        data = _json(response)
        
-        # Add debug logging
-        print("\nLine Items Response:")
-        print(json.dumps(response.json(), indent=2))
+        logger.debug("Line items response: %s", data)
        
-        return response.json()
+        return data
 
     def get_categories(self, document_id):
         """Get categories for document"""
         url = f"{self.base_url}/v2.0/Category/{self.account_id}/GetCategoriesForPostedDocument"
         params = {'documentId': document_id}
-        response = self.session.get(url, params=params)
-        response.raise_for_status()
-        return response.json()
+        response = self._request('GET', url, params=params)
+        return _json(response)
 
     def get_items(self, item_ids):
-        """Get item details"""
+        """Get item details, fetching batches of IDs concurrently"""
         if not item_ids:
             return {'Value': []}
-           
+       
+        # Drop duplicate IDs but keep their original order
+        item_ids = list(dict.fromkeys(item_ids))
+        batches = [
+            item_ids[i:i + ITEMS_BATCH_SIZE]
+            for i in range(0, len(item_ids), ITEMS_BATCH_SIZE)
+        ]
+       
+        with ThreadPoolExecutor(max_workers=min(len(batches), 4)) as executor:
+            results = executor.map(self._get_items_batch, batches)
+            items = [item for batch in results for item in batch]
+       
+        return {'Value': items}
+
+    def _get_items_batch(self, item_ids):
+        """Get item details for a single batch of item IDs"""
         url = f"{self.base_url}/v1.0/Item/{self.account_id}/items"
         params = {'includeNonSellableUOMs': 'false'}
        
         # Create filter string for multiple items
-        filter_str = " or ".join([f"ItemID eq '{id}'" for id in item_ids])
+        filter_str = ",".join(map("'{}'".format, item_ids))
         data = {
-            "Filter": f"({filter_str})",
-            "Top": 100,  # Increased from 50 to handle more items
+            "Filter": f"ItemID in ({filter_str})",
+            "Top": len(item_ids),
             "OrderBy": "ItemDescription asc"
         }
        
-        response = self.session.post(url, params=params, json=data)
-        response.raise_for_status()
-        return response.json()
+        response = self._request('POST', url, params=params, content=orjson.dumps(data))
+        return _json(response).get('Value', [])
 
-def drop_tables(conn):
-    """Drop existing tables to recreate them"""
-    cursor = conn.cursor()
-    cursor.execute('DROP TABLE IF EXISTS harbor_invoice_items')
-    cursor.execute('DROP TABLE IF EXISTS harbor_categories')
-    cursor.execute('DROP TABLE IF EXISTS harbor_invoices')
-    conn.commit()
+def configure_connection(conn):
+    """Apply write-friendly PRAGMAs to a freshly opened connection"""
+    # WAL lets readers run alongside the writer; NORMAL sync is still crash-safe in WAL mode
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('PRAGMA temp_store=MEMORY')
+    conn.execute('PRAGMA cache_size=-64000')
 
-def setup_database():
+def setup_database(conn):
     """Create harbor_invoices and related tables if they don't exist"""
-    conn = sqlite3.connect('clover.db')
     cursor = conn.cursor()
    
     # Create categories table
@@ -124,7 +210,6 @@ def setup_database():
         invoice_total REAL,
         categories TEXT,
         items TEXT,
-        raw_data TEXT,
         created_at TEXT DEFAULT CURRENT_TIMESTAMP
     )
     ''')
@@ -154,37 +239,33 @@ def setup_database():
     )
     ''')
    
+    # Index invoice_id so refreshing an invoice's rows is an index lookup
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_items_invoice ON harbor_invoice_items (invoice_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_categories_invoice ON harbor_categories (invoice_id)')
+   
     conn.commit()
-    return conn
 
 def save_categories(conn, document_id, categories_data):
     """Save category information to database"""
-    cursor = conn.cursor()
-   
     # Clear existing categories for this invoice
-    cursor.execute('DELETE FROM harbor_categories WHERE invoice_id = ?', (document_id,))
+    conn.execute('DELETE FROM harbor_categories WHERE invoice_id = ?', (document_id,))
    
-    # Insert new categories
-    for category_name, category_data in categories_data.items():
-        cursor.execute('''
-        INSERT INTO harbor_categories 
-        (invoice_id, category_name, category_id, item_count, total_cost)
-        VALUES (?, ?, ?, ?, ?)
-        ''', (
+    # Insert new categories in one batch
+    rows = [
+        (
             document_id,
             category_name,
             category_data.get('CategoryID'),
             category_data.get('Count', 0),
             category_data.get('Cost', 0.0)
-        ))
-   
-    conn.commit()
+        )
+        for category_name, category_data in categories_data.items()
+    ]
+    conn.executemany(_INSERT_CATEGORY_SQL, rows)
 
 def save_line_items(conn, document_id, line_items_data, items_data):
-    cursor = conn.cursor()
-   
     # Clear existing items for this invoice
-    cursor.execute('DELETE FROM harbor_invoice_items WHERE invoice_id = ?', (document_id,))
+    conn.execute('DELETE FROM harbor_invoice_items WHERE invoice_id = ?', (document_id,))
    
     # Create a lookup dictionary for item details
     item_details = {}
@@ -193,11 +274,12 @@ def save_line_items(conn, document_id, line_items_data, items_data):
         if item_id:
             item_details[item_id] = item
     
-    # Process each line item
+    # Build one parameter row per line item
+    debug = logger.isEnabledFor(logging.DEBUG)
+    rows = []
     for line_item in line_items_data.get('Value', []):
         item_id = line_item.get('ItemId')
-        item_detail = item_details.get(item_id, {})
-        uom = item_detail.get('UOMs', [{}])[0] if item_detail else {}
+        item_detail = item_details.get(item_id, _EMPTY_DICT)
         
         # Calculate line total
         quantity = line_item.get('OrderQuantity', 0)
@@ -210,20 +292,13 @@ def save_line_items(conn, document_id, line_items_data, items_data):
         # Cost per unit
         cost_per_unit = unit_price / quantity if quantity > 0 else 0.0
         
-        # Debug prints
-        print(f"Processing line item: {line_item}")
-        print(f"Using item details: {item_detail}")
-        print(f"Calculated line total: {line_total}")
-        print(f"Sold by: {sold_by}")
-        print(f"Calculated cost per unit: {cost_per_unit}")
+        if debug:
+            logger.debug(
+                "Line item %s: details=%s line_total=%s sold_by=%s cost_per_unit=%s",
+                line_item, item_detail, line_total, sold_by, cost_per_unit
+            )
 
-        cursor.execute('''
-        INSERT INTO harbor_invoice_items 
-        (invoice_id, item_id, item_description, brand_name, category_id,
-         unit_price, net_price, quantity, uom, retail_upc, vendor_id, srp,
-         margin_pct, package_description, line_total, cost_per_unit, sold_by)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
+        rows.append((
             document_id,
             item_id,
             item_detail.get('Description', line_item.get('Description', 'N/A')),
@@ -242,92 +317,143 @@ def save_line_items(conn, document_id, line_items_data, items_data):
             cost_per_unit,
             sold_by
         ))
-    
-    conn.commit()
+
+    conn.executemany(_INSERT_LINE_ITEM_SQL, rows)
     
     
-def save_invoice(conn, invoice_data):
-    """Save invoice data to database"""
-    cursor = conn.cursor()
+def _write_invoice(conn, invoice_data):
+    """Write one invoice's header, categories and line items; the caller owns the transaction"""
+    # Try to get header from raw_data if not found at top level
+    header = invoice_data['raw_data']['header']
+   
+    logger.debug("Header data found: %s", header)
    
-    print("\n=== Debug Logging for save_invoice ===")
+    conn.execute(_INSERT_INVOICE_SQL, (
+        header['DocumentId'],
+        header['DocumentType'],
+        header['BillToId'],
+        header['BillToName'],
+        header['BillToAddress'],
+        header['BillToCity'],
+        header['BillToState'],
+        header['BillToZip'],
+        header['OrderId'],
+        header['PostedDate'],
+        header['OrderDate'],
+        header['DueDate'],  # Corrected keyword here
+        header['ShipToName'],
+        header['ShipToAddress'],
+        header['ShipToCity'],
+        header['ShipToState'],
+        header['ShipToZip'],
+        header['PaymentTerms'],
+        header['PaymentMethod'],
+        header['TransactionType'],
+        float(header['Allowances']),
+        float(header['Charges']),
+        float(header['Discounts']),
+        float(header['SalesTax']),
+        float(header['SubTotal']),
+        float(header['InvoiceTotal']),
+        orjson.dumps(invoice_data.get('categories', {})).decode(),
+        orjson.dumps(invoice_data.get('items', [])).decode()
+    ))
    
+    # Save categories separately if they exist
+    if 'categories' in invoice_data:
+        save_categories(conn, header['DocumentId'], invoice_data['categories'])
+   
+    # Save line items and items details
+    if 'raw_data' in invoice_data and 'line_items' in invoice_data['raw_data']:
+        save_line_items(
+            conn, 
+            header['DocumentId'], 
+            invoice_data['raw_data']['line_items'],
+            invoice_data['items']
+        )
+
+def _invoice_id(invoice_data):
+    """Best-effort document ID of an invoice, for error reporting"""
+    header = invoice_data.get('raw_data', {}).get('header') or {}
+    return invoice_data.get('document_id') or header.get('DocumentId')
+
+def save_invoices(conn, invoices):
+    """Save a batch of invoices to the database in a single transaction
+
+    Each invoice is written under its own savepoint, so one bad invoice is rolled
+    back on its own instead of taking the rest of the batch with it. Returns a
+    dict mapping the document ID of every dropped invoice to its exception.
+    """
+    failed = {}
     try:
-        # Try to get header from raw_data if not found at top level
-        header = invoice_data['raw_data']['header']
-       
-        print("\nHeader data found:")
-        print(json.dumps(header, indent=2))
-       
-        cursor.execute('''
-        INSERT OR REPLACE INTO harbor_invoices 
-        (document_id, document_type, bill_to_id, bill_to_name, bill_to_address,
-         bill_to_city, bill_to_state, bill_to_zip, order_id, posted_date,
-         order_date, due_date, ship_to_name, ship_to_address, ship_to_city,
-         ship_to_state, ship_to_zip, payment_terms, payment_method,
-         transaction_type, allowances, charges, discounts, sales_tax,
-         subtotal, invoice_total, categories, items, raw_data)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            header['DocumentId'],
-            header['DocumentType'],
-            header['BillToId'],
-            header['BillToName'],
-            header['BillToAddress'],
-            header['BillToCity'],
-            header['BillToState'],
-            header['BillToZip'],
-            header['OrderId'],
-            header['PostedDate'],
-            header['OrderDate'],
-            header['DueDate'],  # Corrected keyword here
-            header['ShipToName'],
-            header['ShipToAddress'],
-            header['ShipToCity'],
-            header['ShipToState'],
-            header['ShipToZip'],
-            header['PaymentTerms'],
-            header['PaymentMethod'],
-            header['TransactionType'],
-            float(header['Allowances']),
-            float(header['Charges']),
-            float(header['Discounts']),
-            float(header['SalesTax']),
-            float(header['SubTotal']),
-            float(header['InvoiceTotal']),
-            json.dumps(invoice_data.get('categories', {})),
-            json.dumps(invoice_data.get('items', [])),
-            json.dumps(invoice_data.get('raw_data', {}))
-        ))
-       
-        # Save categories separately if they exist
-        if 'categories' in invoice_data:
-            save_categories(conn, header['DocumentId'], invoice_data['categories'])
-       
-        # Save line items and items details
-        if 'raw_data' in invoice_data and 'line_items' in invoice_data['raw_data']:
-            save_line_items(
-                conn, 
-                header['DocumentId'], 
-                invoice_data['raw_data']['line_items'],
-                invoice_data['items']
-            )
-       
-        conn.commit()
-        print("\nSuccessfully saved to database!")
+        conn.execute('BEGIN')
+        for invoice_data in invoices:
+            conn.execute('SAVEPOINT invoice')
+            try:
+                _write_invoice(conn, invoice_data)
+            except Exception as e:
+                conn.execute('ROLLBACK TO invoice')
+                conn.execute('RELEASE invoice')
+                document_id = _invoice_id(invoice_data)
+                logger.exception("Dropped invoice %s", document_id)
+                failed[document_id] = e
+            else:
+                conn.execute('RELEASE invoice')
+        conn.execute('COMMIT')
+        print(f"\nSuccessfully saved {len(invoices) - len(failed)} of {len(invoices)} invoice(s) to database!")
+        return failed
        
     except Exception as e:
-        print(f"\nERROR in save_invoice: {str(e)}")
+        if conn.in_transaction:
+            conn.execute('ROLLBACK')
+        print(f"\nERROR in save_invoices: {str(e)}")
         print("Error type:", type(e).__name__)
         import traceback
         print("\nFull traceback:")
         print(traceback.format_exc())
         raise
 
+def save_invoice(conn, invoice_data):
+    """Save invoice data to database"""
+    failed = save_invoices(conn, [invoice_data])
+    if failed:
+        raise next(iter(failed.values()))
 
-def check_database():
+def db_writer(conn, invoice_queue):
+    """Drain fetched invoices from the queue in batches until a None sentinel arrives"""
+    while True:
+        invoice_data = invoice_queue.get()
+        if invoice_data is None:
+            return
+       
+        # Take whatever else is already queued, up to the batch size
+        batch = [invoice_data]
+        stop = False
+        while len(batch) < WRITE_BATCH_SIZE:
+            try:
+                invoice_data = invoice_queue.get_nowait()
+            except Empty:
+                break
+            if invoice_data is None:
+                stop = True
+                break
+            batch.append(invoice_data)
+       
+        try:
+            save_invoices(conn, batch)
+        except Exception:
+            # The batch transaction itself failed; keep draining the queue
+            logger.error(
+                "Dropped a batch of %d invoice(s): %s",
+                len(batch), ", ".join(str(_invoice_id(invoice)) for invoice in batch)
+            )
+       
+        if stop:
+            return
+
+
+def check_database(conn):
     """Function to verify database contents"""
-    conn = sqlite3.connect('clover.db')
     cursor = conn.cursor()
    
     print("\n=== Checking Database Contents ===")
@@ -367,8 +493,55 @@ def check_database():
            
     except sqlite3.Error as e:
         print(f"Error checking database: {e}")
-    finally:
-        conn.close()
+
+def fetch_invoice(api, document_id):
+    """Fetch header, categories, line items and item details for one invoice"""
+    # Header, categories and line items are independent, so fetch them concurrently
+    print(f"\nFetching document header, categories and line items for ID: {document_id}")
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        header_future = executor.submit(api.get_document_header, document_id)
+        categories_future = executor.submit(api.get_categories, document_id)
+        line_items_future = executor.submit(api.get_line_items, document_id)
+        
+        header_data = header_future.result()
+        categories_data = categories_future.result()
+        line_items_data = line_items_future.result()
+    
+    print("\nFetching item details...")
+    # Extract item IDs from line items with debug logging
+    logger.debug("Line items data structure: %s", line_items_data)
+    
+    # Safely extract item IDs
+    try:
+        item_ids = []
+        for item in line_items_data.get('Value', []):
+            item_id = item.get('ItemId')
+            if item_id:
+                item_ids.append(item_id)
+            else:
+                logger.warning("Could not find ItemID in item: %s", item)
+    except Exception as e:
+        print(f"Error extracting item IDs: {str(e)}")
+        logger.debug("Item structure: %s", line_items_data)
+        item_ids = []
+        
+    logger.info("Found %d item IDs", len(item_ids))
+    logger.debug("Item IDs: %s", item_ids)
+    items_data = api.get_items(item_ids) if item_ids else {'Value': []}
+    
+    # Prepare invoice data for storage
+    invoice_data = {
+        'document_id': document_id,
+        'categories': categories_data,
+        'items': items_data,
+        'raw_data': {
+            'header': header_data,
+            'categories': categories_data,
+            'items': items_data,
+            'line_items': line_items_data
+        }
+    }
+    return invoice_data
 
 def main():
     # Initialize API client
@@ -376,73 +549,45 @@ def main():
     
     # Your Bearer token (this should be obtained securely)
     token = "eyJhbGciOiJSUzI1NiIsInR5cCI6IkpXVCIsImtpZCI6Ik5UWkVSa1F3UlVSR09FRXdSRFpDUkVFM1FVWTNNVGN4TkVJMFFUWkJPREkwUkRsR05URkROUSJ9.eyJodHRwOi8vaGFyYm9yZm9vZHMvYXV0aG9yaXplZC1jb21wYW5pZXMiOlsiSFdGIl0sImh0dHA6Ly9oYXJib3J3aG9sZXNhbGUvbG9naW4tZW1haWwiOiJ0aG9tYXMuYS5odXNtYW5uQGdtYWlsLmNvbSIsImh0dHA6Ly9oYXJib3J3aG9sZXNhbGUvc2FsZXMtcmVwLWlkcyI6W10sImh0dHA6Ly9oYXJib3Jmb29kc2VydmljZS9zYWxlcy1yZXAtaWRzIjpbXSwiaHR0cDovL2hhcmJvcndob2xlc2FsZS9hdXRob3JpemVkLWFjY291bnRzIjpbIjcwMDAzMCJdLCJodHRwOi8vaGFyYm9yZm9vZHNlcnZpY2UvYXV0aG9yaXplZC1hY2NvdW50cyI6W10sImlzcyI6Imh0dHBzOi8vaGFyYm9yd2hvbGVzYWxlLmF1dGgwLmNvbS8iLCJzdWIiOiJhdXRoMHw2NDEwYTczY2E5YTRkM2MxYzk5M2IyOGMiLCJhdWQiOlsiaHR0cHM6Ly9hcGkuaGFyYm9yd2hvbGVzYWxlLmNvbSIsImh0dHBzOi8vaGFyYm9yd2hvbGVzYWxlLmF1dGgwLmNvbS91c2VyaW5mbyJdLCJpYXQiOjE3MzM4ODI1MzAsImV4cCI6MTczMzk2ODkzMCwic2NvcGUiOiJvcGVuaWQgcHJvZmlsZSBlbWFpbCBTSE9QUElOR0xJU1RTOlJFQUQgU0hPUFBJTkdMSVNUUzpTSE9QIFNIT1BQSU5HTElTVFM6Q09QWVRPTkVXIFNIT1BQSU5HTElTVFM6UkVTRVFMSVNUIFNIT1BQSU5HTElTVFM6Q1JFQVRFIFNIT1BQSU5HTElTVFM6VVBEQVRFIFNIT1BQSU5HTElTVFM6REVMRVRFIFNIT1BQSU5HTElTVFM6Q1JFQVRFTElORSBTSE9QUElOR0xJU1RTOlVQREFURUxJTkUgU0hPUFBJTkdMSVNUUzpERUxFVEVMSU5FIFNIT1BQSU5HTElTVFM6UkVQUklDRSBJVEVNUzpSRUFEIElURU1ISVNUT1JZOlJFQUQgQ1VTVE9NRVJTOlJFQUQgU0hPUFBJTkdDQVJUUzpSRUFEIFNIT1BQSU5HQ0FSVFM6TU9ESUZZIFNIT1BQSU5HQ0FSVFM6U1VCTUlUU0FMRVNPUkRFUiBTSE9QUElOR0NBUlRTOlNVQk1JVFRBR09SREVSIFNIT1BQSU5HQ0FSVFM6Q0hBTkdFQ0FSVFRZUEUgU0hPUFBJTkdDQVJUUzpSRVNFVFBST0dSRVNTIENBVEVHT1JJRVM6Q1JFQVRFIENBVEVHT1JJRVM6UkVBRCBDQVRFR09SSUVTOlVQREFURSBDQVRFR09SSUVTOkRFTEVURSBCTEFOS0VUT1JERVI6UkVBRCBSRVRVUk5PUkRFUjpSRUFEIFNBTEVTT1JERVI6UkVBRCBTQUxFU09SREVSOk1PRElGWSBQUklDRUlOUVVJUlk6UkVRVUVTVCBCUkFORFM6UkVBRCBUQUdTOlJFQUQgVVNFUkFDQ09VTlRTOlNDT1BFUyBJVEVNQVVUSDpSRUFEIElURU1BVVRIOlNFVFJVTEUgQ09NTUVOVFM6UkVBRCBPUkRFUkhJU1RPUlk6UkVBRCBSRVRBSUxQUklDSU5HOlJFQUQgUkVUQUlMUFJJQ0lORzpVUERBVEUgSVRFTUFVVEg6TU9ESUZZQk9PSyBCTEFOS0VUT1JERVI6TU9ESUZZIFVTRVJBQ0NPVU5UUzpVUERBVEUgSVRFTTpRVFlPTkhBTkQiLCJhenAiOiI2eDM3dlhaZTVrc2xHc3JFenl6TTMzcVhHaWt4Y2h3ZyJ9.PFkjQ0EEcxTSxsU1Ep0h80w9BgPUuWi3yYhU65aA5MKmZNljqUrjd3BBwQ0wHNfDrcdW9brBWjGLg_6wG0yz_6qjbda1P3K8dX3EYqjl04LTsqhaJgE3A426_RghP6FhSyedTCpbjf5KsSrkZdFwaBbiSZcByaB9GOzBOY8LQFjax03UgV4Md9VglWvMzFTFOrMJxmElO488C8R16Nep3fBW7LczIAVhMJidCGJrsjwgrxXstKJsP_YP7VgtJ4cP2qHqfacsxXS6zovshlnBvpPEb8AJB_fkzN8D0cdZ4D1UWL3NUOj5OVvbnCGmLEHzUqxtbiaLoR6wtKEmIsqG0g"
-   # Set up database connection
-    conn = sqlite3.connect('clover.db')
+   # Set up database connection (shared with the writer thread)
+    conn = sqlite3.connect('clover.db', cached_statements=256, check_same_thread=False)
+    configure_connection(conn)
     
     try:
-        # Drop and recreate tables
-        print("Dropping existing tables...")
-        drop_tables(conn)
-        
-        print("Creating new tables...")
-        conn = setup_database()
+        # Create tables if needed; saving an invoice replaces its existing rows
+        print("Setting up tables...")
+        setup_database(conn)
         
         # Authenticate
         api.authenticate(token)
         
-        # Example document ID
-        document_id = "2349466"  # Updated to the invoice we were examining
-        
-        print(f"\nFetching document header for ID: {document_id}")
-        header_data = api.get_document_header(document_id)
-        
-        print("\nFetching categories...")
-        categories_data = api.get_categories(document_id)
+        # Example document IDs
+        document_ids = ["2349466"]  # Updated to the invoice we were examining
         
-        print("\nFetching line items...")
-        line_items_data = api.get_line_items(document_id)
+        # A single writer thread owns all SQLite writes while fetches run in parallel
+        invoice_queue = Queue()
+        writer = threading.Thread(target=db_writer, args=(conn, invoice_queue))
+        writer.start()
         
-        print("\nFetching item details...")
-        # Extract item IDs from line items with debug logging
-        print("Line items data structure:", json.dumps(line_items_data, indent=2))
-        
-        # Safely extract item IDs
         try:
-            item_ids = []
-            for item in line_items_data.get('Value', []):
-                item_id = item.get('ItemId')
-                if item_id:
-                    item_ids.append(item_id)
-                else:
-                    print(f"Warning: Could not find ItemID in item: {json.dumps(item, indent=2)}")
-        except Exception as e:
-            print(f"Error extracting item IDs: {str(e)}")
-            print("Item structure:", json.dumps(line_items_data, indent=2))
-            item_ids = []
-            
-        print(f"Found {len(item_ids)} item IDs: {item_ids}")
-        items_data = api.get_items(item_ids) if item_ids else {'Value': []}
-        
-        # Prepare invoice data for storage
-        invoice_data = {
-            'document_id': document_id,
-            'categories': categories_data,
-            'items': items_data,
-            'raw_data': {
-                'header': header_data,
-                'categories': categories_data,
-                'items': items_data,
-                'line_items': line_items_data
-            }
-        }
-        
-        # Save to database
-        save_invoice(conn, invoice_data)
-        
-        print(f"Successfully processed invoice {document_id}")
+            with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as executor:
+                futures = {
+                    executor.submit(fetch_invoice, api, document_id): document_id
+                    for document_id in document_ids
+                }
+                for future in as_completed(futures):
+                    document_id = futures[future]
+                    try:
+                        invoice_queue.put(future.result())
+                        print(f"Fetched invoice {document_id}")
+                    except Exception as e:
+                        print(f"Error fetching invoice {document_id}: {str(e)}")
+        finally:
+            invoice_queue.put(None)
+            writer.join()
         
         # Verify database contents
-        check_database()
+        check_database(conn)
         
     except Exception as e:
         print(f"Error processing invoice: {str(e)}")
@@ -454,6 +599,7 @@ def main():
         conn.close()
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(name)s: %(message)s")
     main()
    
    